@@ -1,125 +1,203 @@
 from flask import Flask, request, jsonify
-import tempfile
+from flask.json.provider import DefaultJSONProvider
 import base64
+import io
 import os
 import pygame
 import threading
-from werkzeug.utils import secure_filename
+import queue
 import logging
 
+# pybase64 decodes with SIMD where the CPU supports it; same API as base64
+try:
+    import pybase64
+except ImportError:
+    import base64 as pybase64
+
+# orjson encodes JSON several times faster than the stdlib json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes and decodes with orjson."""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
 
+# Route jsonify() and request.get_json() through orjson when it is installed
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
 # Configure upload settings
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
 ALLOWED_EXTENSIONS = {'mp3', 'wav', 'ogg', 'mp4', 'm4a', 'flac', 'aac'}
+STREAM_CHUNK_SIZE = 64 * 1024  # Read size when streaming request bodies
+PLAYBACK_QUEUE_SIZE = 4  # Clips (each held in memory) waiting to play before requests are rejected
+
+# Every byte that may appear in a base64 payload (including line wrapping);
+# used as the delete table for bytes.translate when sniffing request bodies
+_B64_ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=\r\n\t '
 
-# Initialize pygame mixer for audio playback
+# Audio MIME subtype -> file extension used when storing request bodies
+_EXT_MAP = {
+    'wav': '.wav', 'x-wav': '.wav', 'wave': '.wav',
+    'ogg': '.ogg', 'mp4': '.mp4', 'mpeg': '.mp3', 'mp3': '.mp3',
+    'aac': '.aac', 'flac': '.flac'
+}
+
+# Initialize pygame mixer for audio playback. The event queue, used to wait
+# for the end of playback, needs a video driver; the dummy one stays headless
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+pygame.display.init()
 pygame.mixer.init()
+PLAYBACK_END = pygame.USEREVENT + 1
+pygame.mixer.music.set_endevent(PLAYBACK_END)
+
+def looks_like_base64(data):
+    """Check whether data (bytes) consists only of base64 characters.
 
-def allowed_file(filename):
-    """Check if the uploaded file has an allowed extension."""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    Deleting every alphabet byte leaves nothing behind only for pure base64,
+    so the whole check is one C-level pass over the data.
+    """
+    return not data.translate(None, _B64_ALPHABET)
 
-def play_audio_file(file_path):
-    """Play audio file using pygame mixer."""
+def declares_base64(req):
+    """Check whether the request headers say the body is base64 encoded."""
+    return (req.headers.get('Content-Transfer-Encoding', '').lower() == 'base64'
+            or 'base64' in (req.content_type or ''))
+
+def base64_payload(data, declared=False):
+    """Return the base64 payload of a raw request body, or None if it isn't base64.
+
+    A data URL prefix (e.g. "data:audio/mpeg;base64,") is stripped first so
+    such bodies are recognised as base64 too. When the client has declared
+    the body as base64 the alphabet scan is skipped entirely.
+    """
+    payload = data
+    if payload[:1].isspace() or payload[-1:].isspace():
+        payload = payload.strip()
+    if payload.startswith(b'data:'):
+        _, sep, tail = payload.partition(b',')
+        if sep:
+            payload = tail
+    
+    if declared or (len(payload) > 100 and looks_like_base64(payload)):
+        return payload
+    return None
+
+def file_ext_for(content_type):
+    """Map a Content-Type header to a file extension, defaulting to .mp3 (ElevenLabs)."""
+    subtype = (content_type or 'audio/mpeg').split('/', 1)[-1].split(';', 1)[0].strip().lower()
+    return _EXT_MAP.get(subtype, '.mp3')
+
+def validated_ext(filename):
+    """Return the lowercased extension of filename if it is allowed, else None."""
+    dot = filename.rfind('.')
+    if dot < 0:
+        return None
+    ext = filename[dot + 1:].lower()
+    return ext if ext in ALLOWED_EXTENSIONS else None
+
+def play_audio_file(audio_bytes, file_ext='.mp3'):
+    """Play in-memory audio data using pygame mixer."""
     try:
-        logger.info(f"Loading audio file: {file_path}")
-        pygame.mixer.music.load(file_path)
+        logger.info("Loading audio data: %s bytes", len(audio_bytes))
+        # pygame reads straight from memory; the extension hints the format
+        pygame.mixer.music.load(io.BytesIO(audio_bytes), file_ext.lstrip('.'))
         
         logger.info("Starting audio playback")
+        pygame.event.clear(PLAYBACK_END)
         pygame.mixer.music.play()
         
-        # Wait for playback to complete
-        while pygame.mixer.music.get_busy():
-            pygame.time.wait(100)
+        # Sleep until pygame posts the end event (stopping playback posts it
+        # too); the timeout only guards against a missed event
+        while pygame.event.wait(1000).type != PLAYBACK_END:
+            if not pygame.mixer.music.get_busy():
+                break
             
         logger.info("Audio playback completed")
         
     except Exception as e:
-        logger.error(f"Error playing audio: {str(e)}")
-    finally:
-        # Clean up the temporary file
+        logger.error("Error playing audio: %s", e)
+
+# A single long-lived worker plays queued clips one at a time, since the
+# pygame mixer (and the speaker) can only handle one clip at once
+_playback_jobs = queue.Queue(maxsize=PLAYBACK_QUEUE_SIZE)
+
+def playback_worker():
+    """Play queued (audio, file_ext) jobs in arrival order."""
+    while True:
+        audio, file_ext = _playback_jobs.get()
+        play_audio_file(audio, file_ext)
+
+def clear_playback_jobs():
+    """Drop every queued clip that hasn't started playing yet."""
+    while True:
         try:
-            os.unlink(file_path)
-            logger.info(f"Cleaned up temporary file: {file_path}")
-        except Exception as e:
-            logger.error(f"Error cleaning up file: {str(e)}")
+            _playback_jobs.get_nowait()
+        except queue.Empty:
+            return
+
+threading.Thread(target=playback_worker, name='playback-worker', daemon=True).start()
 
 @app.route('/play-audio-raw', methods=['POST'])
 def play_audio_raw():
     """Endpoint to receive raw audio data or base64 encoded data."""
     try:
-        # Get raw audio data from request body
-        audio_data = request.data
+        # Determine file extension based on content type or default to mp3
+        file_ext = file_ext_for(request.content_type)
+        
+        # pygame plays straight from memory, so read the body once without
+        # keeping a cached copy on the request
+        audio_data = request.get_data(cache=False)
         
         if not audio_data:
             return jsonify({'error': 'No audio data provided'}), 400
         
-        logger.info(f"Received raw data: {len(audio_data)} bytes")
-        logger.info(f"Content-Type: {request.content_type}")
+        logger.info("Received raw data: %s bytes", len(audio_data))
+        logger.info("Content-Type: %s", request.content_type)
         
         # Check if this looks like base64 data
-        try:
-            # Try to decode as text first
-            data_str = audio_data.decode('utf-8')
+        audio_bytes = audio_data
+        was_base64 = False
+        payload = base64_payload(audio_data, declares_base64(request))
+        if payload is not None:
+            logger.info("Data appears to be base64 encoded, attempting to decode...")
             
-            # Check if it looks like base64
-            if len(data_str) > 100 and all(c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=' for c in data_str.strip()):
-                logger.info("Data appears to be base64 encoded, attempting to decode...")
-                
-                # Remove data URL prefix if present
-                if ',' in data_str and data_str.startswith('data:'):
-                    data_str = data_str.split(',', 1)[1]
-                
-                # Decode base64
-                audio_bytes = base64.b64decode(data_str)
-                logger.info(f"Successfully decoded base64 to {len(audio_bytes)} bytes")
-                
-            else:
-                # Use raw binary data
-                audio_bytes = audio_data
-                
-        except (UnicodeDecodeError, base64.binascii.Error):
-            # Not text/base64, use as raw binary
-            audio_bytes = audio_data
+            try:
+                audio_bytes = pybase64.b64decode(payload, validate=False)
+                was_base64 = True
+                logger.info("Successfully decoded base64 to %s bytes", len(audio_bytes))
+            except base64.binascii.Error:
+                # Not valid base64 after all, use as raw binary
+                pass
         
-        # Determine file extension based on content type or default to mp3
-        content_type = request.content_type or 'audio/mpeg'
-        if 'wav' in content_type:
-            file_ext = '.wav'
-        elif 'ogg' in content_type:
-            file_ext = '.ogg'
-        elif 'mp4' in content_type:
-            file_ext = '.mp4'
-        else:
-            file_ext = '.mp3'  # Default for ElevenLabs
-        
-        # Create a temporary file to store the audio data
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-            temp_file.write(audio_bytes)
-            temp_file_path = temp_file.name
-        
-        logger.info(f"Saved audio to temporary file: {temp_file_path}")
-        
-        # Play the audio file in a separate thread
-        audio_thread = threading.Thread(target=play_audio_file, args=(temp_file_path,))
-        audio_thread.daemon = True
-        audio_thread.start()
+        # Queue the audio for the playback worker
+        _playback_jobs.put_nowait((audio_bytes, file_ext))
         
         return jsonify({
             'status': 'success',
             'message': f'Audio data ({len(audio_bytes)} bytes) is now playing',
             'file_type': file_ext,
-            'was_base64': len(audio_data) != len(audio_bytes)
+            'was_base64': was_base64
         }), 200
         
+    except queue.Full:
+        logger.warning("Playback queue full, rejecting request")
+        return jsonify({'error': 'Too many audio clips queued, try again later'}), 503
     except Exception as e:
-        logger.error(f"Error in play_audio_raw endpoint: {str(e)}")
+        logger.error("Error in play_audio_raw endpoint: %s", e)
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 @app.route('/play-audio-base64', methods=['POST'])
@@ -150,40 +228,28 @@ def play_audio_base64():
                 'available_fields': list(json_data.keys())
             }), 400
         
-        logger.info(f"Found base64 audio data in field '{audio_field}'")
-        logger.info(f"Base64 string length: {len(base64_audio)} characters")
+        logger.info("Found base64 audio data in field '%s'", audio_field)
+        logger.info("Base64 string length: %s characters", len(base64_audio))
         
         # Decode base64 audio data
         try:
             # Remove data URL prefix if present (e.g., "data:audio/mpeg;base64,")
-            if ',' in base64_audio and base64_audio.startswith('data:'):
-                base64_audio = base64_audio.split(',', 1)[1]
+            if base64_audio.startswith('data:'):
+                _, sep, tail = base64_audio.partition(',')
+                if sep:
+                    base64_audio = tail
             
-            audio_bytes = base64.b64decode(base64_audio)
-            logger.info(f"Decoded audio size: {len(audio_bytes)} bytes")
+            audio_bytes = pybase64.b64decode(base64_audio, validate=False)
+            logger.info("Decoded audio size: %s bytes", len(audio_bytes))
             
         except Exception as e:
             return jsonify({'error': f'Failed to decode base64: {str(e)}'}), 400
         
         # Determine file extension
-        file_ext = '.mp3'  # Default
-        content_type = request.content_type or ''
-        if 'wav' in content_type:
-            file_ext = '.wav'
-        elif 'ogg' in content_type:
-            file_ext = '.ogg'
-        
-        # Create temporary file and save decoded audio
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-            temp_file.write(audio_bytes)
-            temp_file_path = temp_file.name
+        file_ext = file_ext_for(request.content_type)
         
-        logger.info(f"Saved decoded audio to: {temp_file_path}")
-        
-        # Play the audio file in a separate thread
-        audio_thread = threading.Thread(target=play_audio_file, args=(temp_file_path,))
-        audio_thread.daemon = True
-        audio_thread.start()
+        # Queue the audio for the playback worker
+        _playback_jobs.put_nowait((audio_bytes, file_ext))
         
         return jsonify({
             'status': 'success',
@@ -192,8 +258,11 @@ def play_audio_base64():
             'file_type': file_ext
         }), 200
         
+    except queue.Full:
+        logger.warning("Playback queue full, rejecting request")
+        return jsonify({'error': 'Too many audio clips queued, try again later'}), 503
     except Exception as e:
-        logger.error(f"Error in play_audio_base64 endpoint: {str(e)}")
+        logger.error("Error in play_audio_base64 endpoint: %s", e)
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 @app.route('/play-audio', methods=['POST'])
@@ -201,10 +270,10 @@ def play_audio():
     """Endpoint to receive and play audio files."""
     try:
         # Debug: Log what we received
-        logger.info(f"Content-Type: {request.content_type}")
-        logger.info(f"Files: {list(request.files.keys())}")
-        logger.info(f"Form data: {list(request.form.keys())}")
-        logger.info(f"Request data length: {len(request.data)}")
+        logger.info("Content-Type: %s", request.content_type)
+        logger.info("Files: %s", list(request.files.keys()))
+        logger.info("Form data: %s", list(request.form.keys()))
+        logger.info("Request data length: %s", len(request.data))
         
         # Check if a file was uploaded
         if 'audio' not in request.files:
@@ -217,23 +286,20 @@ def play_audio():
             return jsonify({'error': 'No file selected'}), 400
         
         # Validate file type
-        if not allowed_file(file.filename):
+        ext = validated_ext(file.filename)
+        if ext is None:
             return jsonify({
                 'error': f'File type not allowed. Supported formats: {", ".join(ALLOWED_EXTENSIONS)}'
             }), 400
         
-        # Create a temporary file to store the uploaded audio
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file.filename.rsplit(".", 1)[1].lower()}') as temp_file:
-            file.save(temp_file.name)
-            temp_file_path = temp_file.name
+        # Read the uploaded audio into memory for playback
+        file_ext = f'.{ext}'
+        audio_bytes = file.read()
         
-        logger.info(f"Received audio file: {file.filename}")
-        logger.info(f"Saved to temporary file: {temp_file_path}")
+        logger.info("Received audio file: %s (%s bytes)", file.filename, len(audio_bytes))
         
-        # Play the audio file in a separate thread to avoid blocking the response
-        audio_thread = threading.Thread(target=play_audio_file, args=(temp_file_path,))
-        audio_thread.daemon = True
-        audio_thread.start()
+        # Queue the audio for the playback worker
+        _playback_jobs.put_nowait((audio_bytes, file_ext))
         
         return jsonify({
             'status': 'success',
@@ -241,8 +307,11 @@ def play_audio():
             'filename': file.filename
         }), 200
         
+    except queue.Full:
+        logger.warning("Playback queue full, rejecting request")
+        return jsonify({'error': 'Too many audio clips queued, try again later'}), 503
     except Exception as e:
-        logger.error(f"Error in play_audio endpoint: {str(e)}")
+        logger.error("Error in play_audio endpoint: %s", e)
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 @app.route('/status', methods=['GET'])
@@ -258,22 +327,33 @@ def status():
 def debug_request():
     """Debug endpoint to see exactly what we're receiving."""
     try:
+        headers = list(request.headers.items())
+        files = list(request.files.keys())
+        form_keys = list(request.form.keys())
+        
+        # Form bodies are consumed by the parsing above; for anything else keep
+        # the first 100 bytes and just count the rest instead of buffering it
+        preview = request.stream.read(100)
+        raw_data_length = len(preview)
+        while chunk := request.stream.read(STREAM_CHUNK_SIZE):
+            raw_data_length += len(chunk)
+        
         logger.info("=== DEBUG REQUEST ===")
-        logger.info(f"Content-Type: {request.content_type}")
-        logger.info(f"Content-Length: {request.content_length}")
-        logger.info(f"Headers: {dict(request.headers)}")
-        logger.info(f"Files: {list(request.files.keys())}")
-        logger.info(f"Form data: {list(request.form.keys())}")
-        logger.info(f"Raw data length: {len(request.data)}")
-        logger.info(f"Raw data preview: {request.data[:100]}")  # First 100 bytes
+        logger.info("Content-Type: %s", request.content_type)
+        logger.info("Content-Length: %s", request.content_length)
+        logger.info("Headers: %s", headers)
+        logger.info("Files: %s", files)
+        logger.info("Form data: %s", form_keys)
+        logger.info("Raw data length: %s", raw_data_length)
+        logger.info("Raw data preview: %s", preview)  # First 100 bytes
         
         return jsonify({
             'content_type': request.content_type,
             'content_length': request.content_length,
-            'files': list(request.files.keys()),
-            'form_keys': list(request.form.keys()),
-            'raw_data_length': len(request.data),
-            'headers': dict(request.headers)
+            'files': files,
+            'form_keys': form_keys,
+            'raw_data_length': raw_data_length,
+            'headers': headers
         }), 200
         
     except Exception as e:
@@ -283,6 +363,8 @@ def debug_request():
 def stop_audio():
     """Endpoint to stop currently playing audio."""
     try:
+        # Empty the queue first so the worker doesn't start the next clip
+        clear_playback_jobs()
         if pygame.mixer.music.get_busy():
             pygame.mixer.music.stop()
             logger.info("Audio playback stopped")
@@ -290,7 +372,7 @@ def stop_audio():
         else:
             return jsonify({'status': 'info', 'message': 'No audio currently playing'}), 200
     except Exception as e:
-        logger.error(f"Error stopping audio: {str(e)}")
+        logger.error("Error stopping audio: %s", e)
         return jsonify({'error': f'Error stopping audio: {str(e)}'}), 500
 
 if __name__ == '__main__':
@@ -301,5 +383,14 @@ if __name__ == '__main__':
     print("  POST /stop-audio - Stop currently playing audio")
     print(f"Supported audio formats: {', '.join(ALLOWED_EXTENSIONS)}")
     
-    # Run the Flask app
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Run the Flask app under waitress (multi-threaded) when it is installed,
+    # otherwise fall back to the single-threaded development server
+    try:
+        from waitress import serve
+    except ImportError:
+        print("waitress not installed, using the Flask development server")
+        app.run(host='0.0.0.0', port=5000, debug=True)
+    else:
+        serve(app, host='0.0.0.0', port=5000, threads=8,
+              max_request_body_size=app.config['MAX_CONTENT_LENGTH'],
+              recv_bytes=STREAM_CHUNK_SIZE)
\ No newline at end of file
@@ -5,24 +5,122 @@ Listens for wake word, converts speech to text, and sends to n8n webhook
 """
 
 import speech_recognition as sr
-import pyaudio
-import wave
 import threading
 import time
-import requests
+import httpx
+import asyncio
 import json
+import os
 import logging
 from typing import Optional
 import queue
+import collections
+import math
 import numpy as np
 
+# Optional direct microphone capture into a ring buffer; without it audio is
+# captured through speech_recognition's Microphone
+try:
+    import sounddevice as sd
+    SOUNDDEVICE_AVAILABLE = True
+except ImportError:
+    SOUNDDEVICE_AVAILABLE = False
+
+# Optional local wake word spotting; without it the wake word is detected by
+# sending short clips to Google speech recognition
+try:
+    import openwakeword
+    from openwakeword.utils import AudioFeatures, download_models
+    import onnxruntime as ort
+    OPENWAKEWORD_AVAILABLE = SOUNDDEVICE_AVAILABLE
+except ImportError:
+    OPENWAKEWORD_AVAILABLE = False
+
+# Optional voice activity detection used to skip the wake word model on silence
+try:
+    import webrtcvad
+    WEBRTCVAD_AVAILABLE = True
+except ImportError:
+    WEBRTCVAD_AVAILABLE = False
+
+# Optional local speech-to-text for commands; Google is used when it's missing
+# or not confident
+try:
+    import vosk
+    vosk.SetLogLevel(-1)
+    VOSK_AVAILABLE = True
+except ImportError:
+    VOSK_AVAILABLE = False
+
+# Optional faster JSON encoding of webhook payloads
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional JIT compilation of the per-frame energy routine
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Audio is captured as 16 kHz mono int16 in 80 ms frames, the input format of
+# the wake word model, into a ring buffer holding a whole number of frames
+KWS_SAMPLE_RATE = 16000
+KWS_FRAME_SAMPLES = 1280
+RING_SECONDS = 8
+PREROLL_SECONDS = 0.5  # Audio kept from before speech starts in a captured phrase
+
+# Ambient noise calibration is saved here and reused on the next start
+CALIBRATION_FILE = os.path.join(os.path.expanduser("~"), ".cache", "jarvis", "calib.json")
+CALIBRATION_VERSION = 1
+
+WAKE_DEBOUNCE = 1.0  # Seconds after a wake word during which another is ignored
+WEBHOOK_QUEUE_SIZE = 16  # Commands waiting to be posted before new ones are dropped
+WEBHOOK_RETRIES = 2  # Extra attempts after a connection failure or gateway error
+WEBHOOK_RETRY_STATUSES = {502, 503, 504}  # Gateway errors, usually n8n restarting or unreachable
+WEBHOOK_BACKOFF = 0.2  # Seconds before the first retry, doubling each time
+
+# Voice gate: webrtcvad judges 20 ms subframes; the wake word model only runs
+# after a few consecutive speech subframes and for a short hangover afterwards
+VAD_MODE = 2
+VAD_SUBFRAME_BYTES = 640
+VAD_MIN_SPEECH_SUBFRAMES = 3
+VAD_HANGOVER_FRAMES = 6
+VAD_LEAD_IN_FRAMES = 3  # Frames held back by the gate and fed to the model when it opens
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, fastmath=True)
+    def frame_rms_zcr(x):
+        """RMS energy and zero-crossing count of an int16 frame"""
+        if x.shape[0] == 0:
+            return 0.0, 0
+        s = 0.0
+        z = 0
+        for i in range(x.shape[0]):
+            v = float(x[i])
+            s += v * v
+            if i and ((x[i] >= 0) != (x[i - 1] >= 0)):
+                z += 1
+        return math.sqrt(s / x.shape[0]), z
+else:
+    def frame_rms_zcr(x):
+        """RMS energy and zero-crossing count of an int16 frame"""
+        if x.shape[0] == 0:
+            return 0.0, 0
+        signs = x >= 0
+        return float(np.sqrt(np.mean(np.square(x, dtype=np.float32)))), int(np.count_nonzero(signs[1:] != signs[:-1]))
+
 class VoiceAssistant:
     def __init__(self, webhook_url: str, wake_word: str = "assistant", 
-                 timeout: int = 5, phrase_timeout: int = 3):
+                 timeout: int = 5, phrase_timeout: int = 3,
+                 wake_word_model: Optional[str] = None, wake_word_threshold: float = 0.5,
+                 stt_model: str = "en-us", stt_min_confidence: float = 0.6):
         """
         Initialize the Voice Assistant
         
@@ -31,6 +129,11 @@ class VoiceAssistant:
             wake_word: The wake word to listen for (default: "assistant")
             timeout: Seconds to wait for audio input after wake word
             phrase_timeout: Seconds of silence before considering phrase complete
+            wake_word_model: openWakeWord model name or path used for local spotting
+                (default: the bundled model named after the wake word, if there is one)
+            wake_word_threshold: Score (0.0-1.0) a frame must reach to count as the wake word
+            stt_model: Vosk model directory or language code for local command transcription
+            stt_min_confidence: Average word confidence below which Google transcribes instead
         """
         self.webhook_url = webhook_url
         self.wake_word = wake_word.lower()
@@ -41,35 +144,341 @@ class VoiceAssistant:
         self.recognizer = sr.Recognizer()
         self.microphone = sr.Microphone()
         
-        # Audio settings
-        self.chunk = 1024
-        self.format = pyaudio.paInt16
-        self.channels = 1
-        self.rate = 16000
-        
         # State management
         self.listening = False
         self.audio_queue = queue.Queue()
         
+        # Local wake word spotting (see _spot_wake_word)
+        self.wake_word_threshold = wake_word_threshold
+        self._kws_features = None
+        self._kws_session = None
+        self._kws_model = None
+        self._load_wake_word_model(wake_word_model)
+        self._wake_end = None
+        self._last_wake = float('-inf')
+        self._vad = webrtcvad.Vad(VAD_MODE) if WEBRTCVAD_AVAILABLE else None
+        self._speech_run = 0
+        self._gate_hangover = 0
+        self._gated = collections.deque(maxlen=VAD_LEAD_IN_FRAMES)  # Ring positions of rejected frames
+        self._gate_closed = 0  # Frames rejected since the gate last opened
+        
+        # Microphone ring buffer filled by the sounddevice callback; _frames
+        # receives the ring position at the end of each captured frame
+        self._ring = np.zeros(KWS_SAMPLE_RATE * RING_SECONDS, dtype=np.int16)
+        self._ring_pos = 0
+        self._frames = queue.Queue()
+        self._stream = None
+        
+        # Local command transcription (see _transcribe)
+        self.stt_min_confidence = stt_min_confidence
+        self._stt = self._load_stt_model(stt_model)
+        
+        # Webhook requests run on a background event loop so a slow POST never
+        # holds up listening; one client keeps connections to n8n alive
+        self._http = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+                retries=WEBHOOK_RETRIES
+            ),
+            headers={'Content-Type': 'application/json'},
+            timeout=10.0
+        )
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        self._webhook_q = None
+        self._webhook_task = asyncio.run_coroutine_threadsafe(self._webhook_worker(), self._loop)
+        
         # Calibrate microphone
         self._calibrate_microphone()
         
     def _calibrate_microphone(self):
-        """Calibrate microphone for ambient noise"""
+        """Calibrate microphone for ambient noise, reusing the saved calibration for this device"""
+        try:
+            with open(CALIBRATION_FILE, 'r') as f:
+                calib = json.load(f)
+            if (calib.get("version") == CALIBRATION_VERSION
+                    and calib.get("device_index") == self.microphone.device_index):
+                self.recognizer.energy_threshold = calib["energy_threshold"]
+                self.recognizer.dynamic_energy_threshold = calib["dynamic_energy_threshold"]
+                logger.info("Microphone calibration restored from cache")
+                return
+        except (OSError, ValueError, KeyError):
+            pass
+        
         logger.info("Calibrating microphone for ambient noise...")
         with self.microphone as source:
             self.recognizer.adjust_for_ambient_noise(source, duration=2)
         logger.info("Microphone calibrated")
+        
+        try:
+            os.makedirs(os.path.dirname(CALIBRATION_FILE), exist_ok=True)
+            with open(CALIBRATION_FILE, 'w') as f:
+                json.dump({
+                    "energy_threshold": self.recognizer.energy_threshold,
+                    "dynamic_energy_threshold": self.recognizer.dynamic_energy_threshold,
+                    "device_index": self.microphone.device_index,
+                    "version": CALIBRATION_VERSION
+                }, f)
+        except OSError as e:
+            logger.warning(f"Could not save microphone calibration: {e}")
+    
+    def _quantized_model_path(self, model_path: str) -> str:
+        """
+        Return an int8 copy of an ONNX model, quantizing it on first use
+        Falls back to the original model if quantization fails
+        """
+        int8_path = os.path.splitext(model_path)[0] + ".int8.onnx"
+        if os.path.exists(int8_path):
+            return int8_path
+        
+        try:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(model_path, int8_path, weight_type=QuantType.QInt8)
+            logger.info(f"Quantized wake word model to {int8_path}")
+            return int8_path
+        except Exception as e:
+            logger.warning(f"Could not quantize wake word model, using FP32: {e}")
+            return model_path
+    
+    def _load_wake_word_model(self, model_name: Optional[str]):
+        """
+        Load the wake word classifier as an int8 onnxruntime session, with
+        openWakeWord's shared melspectrogram/embedding models as its front end
+        Leaves _kws_session as None to use cloud detection
+        """
+        if not OPENWAKEWORD_AVAILABLE:
+            logger.info("openWakeWord not available - using cloud wake word detection")
+            return
+        
+        if model_name is None:
+            # Only spot locally when a bundled model was trained on this wake word
+            model_name = self.wake_word.replace(" ", "_")
+            if model_name not in openwakeword.MODELS:
+                logger.info(f"No openWakeWord model for '{self.wake_word}' - using cloud wake word detection")
+                return
+        
+        try:
+            # openWakeWord >= 0.5 doesn't ship its models; fetch the feature
+            # models and this classifier on first use
+            download_models([model_name])
+            
+            if os.path.exists(model_name):
+                model_path = model_name
+            else:
+                model_path = openwakeword.MODELS[model_name]["model_path"].replace(".tflite", ".onnx")
+            
+            so = ort.SessionOptions()
+            so.intra_op_num_threads = 2
+            so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            session = ort.InferenceSession(
+                self._quantized_model_path(model_path),
+                sess_options=so,
+                providers=["CPUExecutionProvider"]
+            )
+            
+            self._kws_features = AudioFeatures(inference_framework="onnx")
+            self._kws_input = session.get_inputs()[0]
+            self._kws_window = self._kws_input.shape[1]  # Embedding frames per prediction
+            self._kws_session = session
+            self._kws_model = model_name
+            logger.info(f"Using local wake word model: {model_name}")
+        except Exception as e:
+            logger.warning(f"Could not load wake word model '{model_name}': {e}")
+    
+    def _on_audio_frame(self, indata, frames, time_info, status):
+        """sounddevice callback - copy each 80 ms frame into the ring buffer"""
+        start = self._ring_pos % len(self._ring)
+        self._ring[start:start + frames] = np.frombuffer(indata, dtype=np.int16)
+        self._ring_pos += frames
+        self._frames.put(self._ring_pos)
+    
+    def _start_audio_stream(self):
+        """
+        Start capturing the microphone into the ring buffer
+        Leaves _stream as None, so capture goes through sr.Microphone, if the
+        device can't be opened at 16 kHz mono
+        """
+        if SOUNDDEVICE_AVAILABLE and self._stream is None:
+            try:
+                stream = sd.RawInputStream(
+                    samplerate=KWS_SAMPLE_RATE,
+                    blocksize=KWS_FRAME_SAMPLES,
+                    channels=1,
+                    dtype='int16',
+                    callback=self._on_audio_frame
+                )
+                stream.start()
+                self._stream = stream
+            except Exception as e:
+                logger.warning(f"Could not open microphone stream, using speech_recognition capture: {e}")
+    
+    def _stop_audio_stream(self):
+        """Stop capturing the microphone"""
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+    
+    def _ring_samples(self, start: int, end: int) -> np.ndarray:
+        """Samples between two ring positions, as a view unless they wrap around"""
+        size = len(self._ring)
+        start = max(start, self._ring_pos - size)
+        offset = start % size
+        if offset + end - start <= size:
+            return self._ring[offset:offset + end - start]
+        return np.concatenate((self._ring[offset:], self._ring[:end - start - (size - offset)]))
+    
+    def _adjust_energy_threshold(self, energy: float):
+        """
+        Track ambient noise on a non-speech frame, the same way
+        Recognizer.listen does when dynamic_energy_threshold is set
+        """
+        if self.recognizer.dynamic_energy_threshold:
+            damping = self.recognizer.dynamic_energy_adjustment_damping ** (KWS_FRAME_SAMPLES / KWS_SAMPLE_RATE)
+            target_energy = energy * self.recognizer.dynamic_energy_ratio
+            self.recognizer.energy_threshold = self.recognizer.energy_threshold * damping + target_energy * (1 - damping)
+    
+    def _frame_at(self, pos: int) -> Optional[np.ndarray]:
+        """The 80 ms frame ending at a ring position, or None if it has been overwritten"""
+        if pos <= self._ring_pos - len(self._ring):
+            return None
+        frame = self._ring_samples(pos - KWS_FRAME_SAMPLES, pos)
+        return frame if len(frame) == KWS_FRAME_SAMPLES else None
+    
+    def _listen(self, timeout: float, phrase_time_limit: float, start: Optional[int] = None) -> sr.AudioData:
+        """
+        Capture one phrase, ending after pause_threshold seconds below the
+        recognizer's energy threshold
+        
+        Args:
+            timeout: Seconds to wait for the phrase to start
+            phrase_time_limit: Maximum length of the phrase in seconds
+            start: Ring position to start from (default: now)
+            
+        Raises sr.WaitTimeoutError if no phrase starts within timeout
+        """
+        if self._stream is None:
+            with self.microphone as source:
+                return self.recognizer.listen(source, timeout=timeout, phrase_time_limit=phrase_time_limit)
+        
+        if start is None:
+            start = self._ring_pos
+        pause_samples = int(self.recognizer.pause_threshold * KWS_SAMPLE_RATE)
+        onset = None
+        silent = 0
+        
+        while True:
+            try:
+                pos = self._frames.get(timeout=1)
+            except queue.Empty:
+                raise sr.WaitTimeoutError("no audio from microphone")
+            if pos <= start:
+                continue
+            
+            # Skip frames the ring has already overwritten while we fell behind
+            frame = self._frame_at(pos)
+            if frame is None:
+                continue
+            
+            energy = frame_rms_zcr(frame)[0]
+            speaking = energy > self.recognizer.energy_threshold
+            
+            if onset is None:
+                if speaking:
+                    onset = max(start, pos - KWS_FRAME_SAMPLES - int(PREROLL_SECONDS * KWS_SAMPLE_RATE))
+                    continue
+                self._adjust_energy_threshold(energy)
+                if pos - start >= timeout * KWS_SAMPLE_RATE:
+                    raise sr.WaitTimeoutError("listening timed out while waiting for phrase to start")
+                continue
+            
+            silent = 0 if speaking else silent + KWS_FRAME_SAMPLES
+            if silent >= pause_samples or pos - onset >= phrase_time_limit * KWS_SAMPLE_RATE:
+                return sr.AudioData(self._ring_samples(onset, pos).tobytes(), KWS_SAMPLE_RATE, 2)
+    
+    def _voice_gate(self, frame: np.ndarray) -> bool:
+        """
+        Cheap first stage in front of the wake word model
+        Returns True if the frame should be scored
+        """
+        rms, _ = frame_rms_zcr(frame)
+        triggered = False
+        if rms < self.recognizer.energy_threshold:
+            # Too quiet to be speech, no need to ask webrtcvad
+            self._adjust_energy_threshold(rms)
+            self._speech_run = 0
+        elif self._vad is None:
+            triggered = True
+        else:
+            data = frame.tobytes()
+            for start in range(0, len(data), VAD_SUBFRAME_BYTES):
+                if self._vad.is_speech(data[start:start + VAD_SUBFRAME_BYTES], KWS_SAMPLE_RATE):
+                    self._speech_run += 1
+                    triggered = triggered or self._speech_run >= VAD_MIN_SPEECH_SUBFRAMES
+                else:
+                    self._speech_run = 0
+        
+        if triggered:
+            self._gate_hangover = VAD_HANGOVER_FRAMES
+            return True
+        if self._gate_hangover:
+            self._gate_hangover -= 1
+            return True
+        return False
+    
+    def _spot_wake_word(self) -> bool:
+        """
+        Run one audio frame through the local wake word model
+        Returns True if wake word is detected
+        """
+        try:
+            pos = self._frames.get(timeout=1)
+        except queue.Empty:
+            return False
+        
+        frame = self._frame_at(pos)
+        if frame is None:
+            return False
+        if not self._voice_gate(frame):
+            self._gated.append(pos)
+            self._gate_closed += 1
+            return False
+        
+        # After a long quiet spell the model's context is stale audio; start it
+        # afresh, then feed the lead-in the gate held back so the start of the
+        # wake word isn't lost
+        if self._gate_closed > VAD_LEAD_IN_FRAMES:
+            self._kws_features.reset()
+        for gated_pos in self._gated:
+            gated_frame = self._frame_at(gated_pos)
+            if gated_frame is not None:
+                self._kws_features(gated_frame)
+        self._gated.clear()
+        self._gate_closed = 0
+        
+        self._kws_features(frame)
+        features = self._kws_features.get_features(self._kws_window)
+        score = self._kws_session.run(None, {self._kws_input.name: features})[0]
+        if score.max() < self.wake_word_threshold:
+            return False
+        
+        self._kws_features.reset()
+        self._wake_end = pos
+        return True
     
     def _listen_for_wake_word(self) -> bool:
         """
-        Listen for the wake word using simple speech recognition
+        Listen for the wake word, locally if a wake word model is loaded,
+        otherwise using simple speech recognition
         Returns True if wake word is detected
         """
+        if self._kws_session is not None and self._stream is not None:
+            return self._spot_wake_word()
+        
         try:
-            with self.microphone as source:
-                # Listen for audio with a shorter timeout for wake word detection
-                audio = self.recognizer.listen(source, timeout=1, phrase_time_limit=3)
+            # Listen for audio with a shorter timeout for wake word detection
+            audio = self._listen(timeout=1, phrase_time_limit=3)
             
             # Use Google's free speech recognition for wake word detection
             text = self.recognizer.recognize_google(audio).lower()
@@ -87,6 +496,53 @@ class VoiceAssistant:
             logger.error(f"Speech recognition error: {e}")
             return False
     
+    def _load_stt_model(self, stt_model: str):
+        """Load the Vosk recognizer for local transcription, or return None to use Google only"""
+        if not VOSK_AVAILABLE:
+            logger.info("Vosk not available - transcribing commands with Google")
+            return None
+        
+        try:
+            if os.path.isdir(stt_model):
+                model = vosk.Model(stt_model)
+            else:
+                model = vosk.Model(lang=stt_model)
+            recognizer = vosk.KaldiRecognizer(model, KWS_SAMPLE_RATE)
+            recognizer.SetWords(True)
+            logger.info(f"Using local speech-to-text model: {stt_model}")
+            return recognizer
+        except Exception as e:
+            logger.warning(f"Could not load speech-to-text model '{stt_model}': {e}")
+            return None
+    
+    def _transcribe_locally(self, raw: bytes) -> Optional[str]:
+        """
+        Transcribe 16 kHz PCM with Vosk
+        Returns None if there is no local model or it isn't confident
+        """
+        if self._stt is None:
+            return None
+        
+        self._stt.AcceptWaveform(raw)
+        result = json.loads(self._stt.FinalResult())
+        words = result.get("result", [])
+        if not words:
+            return None
+        
+        confidence = sum(word["conf"] for word in words) / len(words)
+        if confidence < self.stt_min_confidence:
+            logger.debug(f"Local transcript '{result['text']}' below confidence ({confidence:.2f})")
+            return None
+        return result["text"]
+    
+    def _transcribe(self, audio: sr.AudioData) -> str:
+        """
+        Transcribe a command locally with Vosk, falling back to Google speech
+        recognition
+        """
+        raw = audio.get_raw_data(convert_rate=KWS_SAMPLE_RATE, convert_width=2)
+        return self._transcribe_locally(raw) or self.recognizer.recognize_google(audio)
+    
     def _record_command(self) -> Optional[str]:
         """
         Record and transcribe voice command after wake word detection
@@ -95,18 +551,18 @@ class VoiceAssistant:
         logger.info("Wake word detected! Listening for command...")
         
         try:
-            with self.microphone as source:
-                # Listen for the actual command with longer timeout
-                audio = self.recognizer.listen(
-                    source, 
-                    timeout=self.timeout, 
-                    phrase_time_limit=self.phrase_timeout
-                )
+            # Listen for the actual command with longer timeout, starting
+            # right where the wake word ended so the first word isn't lost
+            audio = self._listen(
+                timeout=self.timeout, 
+                phrase_time_limit=self.phrase_timeout,
+                start=self._wake_end
+            )
             
             logger.info("Processing voice command...")
             
             # Transcribe the command
-            command_text = self.recognizer.recognize_google(audio)
+            command_text = self._transcribe(audio)
             logger.info(f"Command recognized: {command_text}")
             
             return command_text
@@ -121,31 +577,62 @@ class VoiceAssistant:
             logger.error(f"Speech recognition service error: {e}")
             return None
     
-    def _send_to_webhook(self, command: str) -> bool:
+    def _send_to_webhook(self, command: str):
         """
-        Send the voice command to n8n webhook
+        Queue the voice command for the n8n webhook; it is posted in the
+        background by _webhook_worker
         
         Args:
             command: The transcribed voice command
+        """
+        payload = {
+            "command": command,
+            "timestamp": time.time(),
+            "source": "voice_assistant"
+        }
+        self._loop.call_soon_threadsafe(self._enqueue_webhook, payload)
+    
+    def _enqueue_webhook(self, payload: dict):
+        """Add a payload to the webhook queue (runs on the event loop)"""
+        try:
+            self._webhook_q.put_nowait(payload)
+        except asyncio.QueueFull:
+            logger.error(f"Webhook queue full, dropping command: {payload['command']}")
+    
+    async def _webhook_worker(self):
+        """Post queued commands to the webhook one at a time"""
+        self._webhook_q = asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+        while True:
+            payload = await self._webhook_q.get()
+            try:
+                if await self._post_webhook(payload):
+                    logger.info("Command processed successfully")
+                else:
+                    logger.error("Failed to process command")
+            except Exception as e:
+                logger.error(f"Webhook worker error: {e}")
+            finally:
+                self._webhook_q.task_done()
+    
+    async def _post_webhook(self, payload: dict) -> bool:
+        """
+        Send a voice command payload to n8n webhook
+        
+        Args:
+            payload: The JSON body built by _send_to_webhook
             
         Returns:
             True if successful, False otherwise
         """
         try:
-            payload = {
-                "command": command,
-                "timestamp": time.time(),
-                "source": "voice_assistant"
-            }
-            
-            logger.info(f"Sending command to webhook: {command}")
-            
-            response = requests.post(
-                self.webhook_url,
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=10
-            )
+            logger.info(f"Sending command to webhook: {payload['command']}")
+            
+            body = orjson.dumps(payload) if orjson else json.dumps(payload).encode()
+            for attempt in range(WEBHOOK_RETRIES + 1):
+                response = await self._http.post(self.webhook_url, content=body)
+                if response.status_code not in WEBHOOK_RETRY_STATUSES or attempt == WEBHOOK_RETRIES:
+                    break
+                await asyncio.sleep(WEBHOOK_BACKOFF * 2 ** attempt)
             
             if response.status_code == 200:
                 logger.info("Command sent successfully to n8n workflow")
@@ -154,38 +641,58 @@ class VoiceAssistant:
                 logger.error(f"Webhook request failed with status {response.status_code}")
                 return False
                 
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Error sending to webhook: {e}")
             return False
     
+    async def _drain_webhooks(self):
+        """Give queued commands a chance to be sent, then close the client"""
+        try:
+            await asyncio.wait_for(self._webhook_q.join(), timeout=10)
+        except asyncio.TimeoutError:
+            logger.warning("Unsent webhook commands dropped on shutdown")
+        await self._http.aclose()
+    
+    def _close_http(self):
+        """Flush the webhook queue, close the client and stop its event loop"""
+        if self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._drain_webhooks(), self._loop).result(timeout=15)
+            self._webhook_task.cancel()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+    
     def run(self):
         """Main loop - listen for wake word and process commands"""
-        logger.info(f"Voice Assistant started. Listening for wake word: '{self.wake_word}'")
+        if self._kws_session is not None:
+            logger.info(f"Voice Assistant started. Listening for wake word model: '{self._kws_model}'")
+        else:
+            logger.info(f"Voice Assistant started. Listening for wake word: '{self.wake_word}'")
         logger.info("Press Ctrl+C to stop")
         
+        self._start_audio_stream()
         try:
             while True:
                 # Listen for wake word
                 if self._listen_for_wake_word():
+                    # Ignore a repeat trigger straight after the last one
+                    now = time.monotonic()
+                    if now - self._last_wake < WAKE_DEBOUNCE:
+                        continue
+                    self._last_wake = now
+                    
                     # Record and process command
                     command = self._record_command()
                     
                     if command:
-                        # Send command to n8n workflow
-                        success = self._send_to_webhook(command)
-                        
-                        if success:
-                            logger.info("Command processed successfully")
-                        else:
-                            logger.error("Failed to process command")
-                    
-                    # Brief pause before listening for wake word again
-                    time.sleep(1)
+                        # Queue command for the n8n workflow
+                        self._send_to_webhook(command)
                 
         except KeyboardInterrupt:
             logger.info("Voice Assistant stopped by user")
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
+        finally:
+            self._stop_audio_stream()
+            self._close_http()
 
 def main():
     # Configuration - Update these values for your setup
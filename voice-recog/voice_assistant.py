@@ -6,18 +6,23 @@ and sends them to an n8n webhook for processing.
 """
 
 import speech_recognition as sr
-import pyaudio
-import wave
 import time
 import json
-import requests
+import httpx
+import asyncio
 import yaml
+import pickle
 import threading
 import queue
 import logging
-from datetime import datetime
+import hashlib
 from pathlib import Path
+from collections import deque
 import sys
+import math
+
+# Use libyaml's C parser when PyYAML was built with it
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
 # Optional imports for advanced features
 try:
@@ -27,49 +32,210 @@ except ImportError:
     SNOWBOY_AVAILABLE = False
     print("Snowboy not available - using simple keyword detection")
 
-try:
-    from pydub import AudioSegment
-    from pydub.effects import normalize
-    PYDUB_AVAILABLE = True
-except ImportError:
-    PYDUB_AVAILABLE = False
-    print("Pydub not available - noise reduction disabled")
-
+# soundfile is imported where the acknowledgment file is decoded, so it's only
+# loaded when that is needed
 try:
     import numpy as np
     import sounddevice as sd
-    import soundfile as sf
     AUDIO_PLAYBACK_AVAILABLE = True
 except ImportError:
     AUDIO_PLAYBACK_AVAILABLE = False
     print("Audio playback not available - wake word acknowledgment disabled")
 
+try:
+    import openwakeword
+    from openwakeword.utils import AudioFeatures, download_models
+    import onnxruntime as ort
+    OPENWAKEWORD_AVAILABLE = AUDIO_PLAYBACK_AVAILABLE  # Needs numpy/sounddevice for capture
+except ImportError:
+    OPENWAKEWORD_AVAILABLE = False
+    print("openWakeWord not available - using cloud wake word detection")
+
+try:
+    import webrtcvad
+    WEBRTCVAD_AVAILABLE = True
+except ImportError:
+    WEBRTCVAD_AVAILABLE = False
+    print("webrtcvad not available - wake word model will score every frame")
+
+try:
+    import vosk
+    vosk.SetLogLevel(-1)
+    VOSK_AVAILABLE = True
+except ImportError:
+    VOSK_AVAILABLE = False
+    print("Vosk not available - transcribing commands with Google")
+
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Parsed config, microphone calibration and the decoded acknowledgment sound are cached here
+CACHE_DIR = Path.home() / '.cache' / 'jarvis'
+CALIBRATION_VERSION = 1
+
+WAKE_DEBOUNCE = 1.0  # Seconds after a wake word during which another is ignored
+WEBHOOK_QUEUE_SIZE = 16  # Commands waiting to be posted before new ones are dropped
+WEBHOOK_RETRIES = 2  # Extra attempts after a connection failure or gateway error
+WEBHOOK_RETRY_STATUSES = {502, 503, 504}  # Gateway errors, usually n8n restarting or unreachable
+WEBHOOK_BACKOFF = 0.2  # Seconds before the first retry, doubling each time
+
+# Audio is captured as 16 kHz mono int16 in 80 ms frames (what openWakeWord
+# consumes) into a ring buffer long enough for the longest command
+KWS_SAMPLE_RATE = 16000
+KWS_FRAME_SAMPLES = 1280
+RING_SECONDS = 12
+PREROLL_SECONDS = 0.5  # Audio kept from before speech starts in a captured phrase
+
+# webrtcvad judges 20 ms subframes; the wake word model only runs after a few
+# consecutive speech subframes and for a short hangover afterwards
+VAD_SUBFRAME_BYTES = 640
+VAD_MIN_SPEECH_SUBFRAMES = 3
+VAD_HANGOVER_FRAMES = 6
+VAD_LEAD_IN_FRAMES = 3  # Frames held back by the gate and fed to the model when it opens
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, fastmath=True)
+    def frame_rms_zcr(x):
+        """RMS energy and zero-crossing count of an int16 frame"""
+        if x.shape[0] == 0:
+            return 0.0, 0
+        s = 0.0
+        z = 0
+        for i in range(x.shape[0]):
+            v = float(x[i])
+            s += v * v
+            if i and ((x[i] >= 0) != (x[i - 1] >= 0)):
+                z += 1
+        return math.sqrt(s / x.shape[0]), z
+else:
+    def frame_rms_zcr(x):
+        """RMS energy and zero-crossing count of an int16 frame"""
+        if x.shape[0] == 0:
+            return 0.0, 0
+        signs = x >= 0
+        return float(np.sqrt(np.mean(np.square(x, dtype=np.float32)))), int(np.count_nonzero(signs[1:] != signs[:-1]))
+
 
 class VoiceAssistant:
     def __init__(self, config_path="config.yaml"):
         self.config = self.load_config(config_path)
         self.setup_logging()
         
+        # Wake word and stop phrases are found in every transcript with a single
+        # scan, using an Aho-Corasick automaton when pyahocorasick is installed
+        self.wake_word = self.config['wake_word'].lower()
+        self.phrase_kinds = {phrase.lower(): 'STOP' for phrase in self.config['stop_phrases'] if phrase}
+        self.phrase_kinds[self.wake_word] = 'WAKE'
+        self.automaton = None
+        if AHOCORASICK_AVAILABLE:
+            self.automaton = ahocorasick.Automaton()
+            for phrase, kind in self.phrase_kinds.items():
+                self.automaton.add_word(phrase, kind)
+            self.automaton.make_automaton()
+        
         # Audio setup
         self.recognizer = sr.Recognizer()
         self.microphone = sr.Microphone()
         
+        # Acknowledgment sound is decoded once up front and written to an
+        # output stream kept open for the whole session. Support both old
+        # 'wav_file' and new 'audio_file' config keys for backward compatibility
+        tone_config = self.config['acknowledgment_tone']
+        self.ack_path = Path(tone_config.get('audio_file') or tone_config.get('wav_file', 'acknowledgment.wav')).expanduser()
+        self.ack_ext = self.ack_path.suffix.upper()
+        self.ack_exists = self.ack_path.is_file()
+        self.ack_data, self.ack_rate = self.load_acknowledgment_sound()
+        self.ack_stream = self.open_acknowledgment_stream()
+        
         # State management
         self.listening = False
         self.wake_detected = False
+        self.last_wake = float('-inf')
         self.audio_queue = queue.Queue()
         
+        # Microphone ring buffer filled by the sounddevice callback; frames
+        # receives the ring position at the end of each captured frame
+        self.ring = np.zeros(KWS_SAMPLE_RATE * RING_SECONDS, dtype=np.int16) if AUDIO_PLAYBACK_AVAILABLE else None
+        self.ring_pos = 0
+        self.frames = queue.Queue()
+        self.phrase_end = None  # Ring position where the last listen() phrase ended
+        self.wake_end = None  # Ring position command capture starts from
+        self.stream = None
+        
+        # Local command transcription (falls back to Google)
+        self.stt = self.load_stt_model()
+        
+        # Local wake word spotting (falls back to cloud recognition)
+        self.kws_features = None
+        self.kws_session = None
+        self.kws_model = None
+        self.load_wake_word_model()
+        self.vad = webrtcvad.Vad(self.config.get('vad_aggressiveness', 2)) if WEBRTCVAD_AVAILABLE else None
+        self.speech_run = 0
+        self.gate_hangover = 0
+        self.gated = deque(maxlen=VAD_LEAD_IN_FRAMES)  # Ring positions of rejected frames
+        self.gate_closed = 0  # Frames rejected since the gate last opened
+        
+        # Webhook requests run on a background event loop so listening carries
+        # on during a POST; one client keeps connections to n8n alive
+        self.http = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+                retries=WEBHOOK_RETRIES
+            ),
+            headers={'Content-Type': 'application/json'},
+            timeout=10.0
+        )
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.webhook_queue = None
+        self.webhook_task = asyncio.run_coroutine_threadsafe(self.webhook_worker(), self.loop)
+        self.stopped = False
+        
         # Initialize recognizer settings
-        with self.microphone as source:
-            self.recognizer.adjust_for_ambient_noise(source)
+        self.calibrate_microphone()
             
         self.logger.info("Voice Assistant initialized")
         
     def load_config(self, config_path):
-        """Load configuration from YAML file"""
+        """Load configuration from YAML file, or its pickled copy if that is up to date"""
+        # Cached outside the working tree, one file per config path
+        config_key = hashlib.sha1(str(Path(config_path).resolve()).encode()).hexdigest()[:16]
+        cache_path = CACHE_DIR / f"config-{config_key}.pkl"
+        try:
+            if cache_path.stat().st_mtime >= Path(config_path).stat().st_mtime:
+                with open(cache_path, 'rb') as file:
+                    return pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+        
         try:
             with open(config_path, 'r') as file:
-                config = yaml.safe_load(file)
+                config = yaml.load(file, Loader=YAML_LOADER)
+            
+            try:
+                CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                with open(cache_path, 'wb') as file:
+                    pickle.dump(config, file, protocol=5)
+            except OSError as e:
+                print(f"Could not cache config: {e}")
+            
             return config
         except FileNotFoundError:
             # Default configuration
@@ -84,6 +250,10 @@ class VoiceAssistant:
                 'dynamic_energy_threshold': True,
                 'pause_threshold': 0.8,
                 'snowboy_model': 'jarvis.pmdl',  # Optional Snowboy model file
+                'wake_word_threshold': 0.5,
+                'vad_aggressiveness': 2,  # webrtcvad mode (0-3) gating the wake word model
+                'stt_model': 'en-us',  # Vosk model directory or language code
+                'stt_min_confidence': 0.6,  # Below this Google transcribes instead
                 'logging_level': 'INFO',
                 'acknowledgment_tone': {
                     'enabled': True,
@@ -115,87 +285,203 @@ class VoiceAssistant:
         )
         self.logger = logging.getLogger(__name__)
     
-    def play_acknowledgment_tone(self):
-        """Play an audio file (WAV, MP3, etc.) or fallback tone to acknowledge wake word detection"""
-        if not self.config['acknowledgment_tone']['enabled']:
+    def quantized_model_path(self, model_path):
+        """Return an int8 copy of an ONNX model, quantizing it on first use"""
+        int8_path = Path(model_path).with_suffix('.int8.onnx')
+        if int8_path.exists():
+            return str(int8_path)
+        
+        try:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(model_path, str(int8_path), weight_type=QuantType.QInt8)
+            self.logger.info(f"Quantized wake word model to {int8_path}")
+            return str(int8_path)
+        except Exception as e:
+            self.logger.warning(f"Could not quantize wake word model, using FP32: {e}")
+            return model_path
+    
+    def load_wake_word_model(self):
+        """Load the wake word classifier as an int8 onnxruntime session for local spotting"""
+        if not OPENWAKEWORD_AVAILABLE:
             return
+        
+        model_name = self.config.get('wake_word_model')
+        if model_name is None:
+            # Only spot locally when a bundled model was trained on this wake word
+            model_name = self.wake_word.replace(' ', '_')
+            if model_name not in openwakeword.MODELS:
+                self.logger.info(f"No openWakeWord model for '{self.wake_word}' - using cloud wake word detection")
+                return
+        
+        try:
+            # openWakeWord >= 0.5 doesn't ship its models; fetch the feature
+            # models and this classifier on first use
+            download_models([model_name])
             
-        if not AUDIO_PLAYBACK_AVAILABLE:
-            self.logger.warning("Audio playback not available - cannot play acknowledgment")
-            return
+            if Path(model_name).exists():
+                model_path = model_name
+            else:
+                model_path = openwakeword.MODELS[model_name]['model_path'].replace('.tflite', '.onnx')
+            
+            so = ort.SessionOptions()
+            so.intra_op_num_threads = 2
+            so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            session = ort.InferenceSession(
+                self.quantized_model_path(model_path),
+                sess_options=so,
+                providers=['CPUExecutionProvider']
+            )
             
+            # openWakeWord's melspectrogram/embedding models turn audio into classifier input
+            self.kws_features = AudioFeatures(inference_framework='onnx')
+            self.kws_input = session.get_inputs()[0]
+            self.kws_window = self.kws_input.shape[1]
+            self.kws_session = session
+            self.kws_model = model_name
+            self.logger.info(f"Using local wake word model: {model_name}")
+        except Exception as e:
+            self.logger.warning(f"Could not load wake word model '{model_name}': {e}, using cloud detection")
+    
+    def calibrate_microphone(self):
+        """Adjust for ambient noise, reusing the saved calibration for this device"""
+        calib_file = CACHE_DIR / 'calib.json'
+        try:
+            with open(calib_file, 'r') as file:
+                calib = json.load(file)
+            if (calib.get('version') == CALIBRATION_VERSION
+                    and calib.get('device_index') == self.microphone.device_index):
+                self.recognizer.energy_threshold = calib['energy_threshold']
+                self.recognizer.dynamic_energy_threshold = calib['dynamic_energy_threshold']
+                self.logger.debug(f"Restored microphone calibration from {calib_file}")
+                return
+        except (OSError, ValueError, KeyError):
+            pass
+        
+        with self.microphone as source:
+            self.recognizer.adjust_for_ambient_noise(source)
+        
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            with open(calib_file, 'w') as file:
+                json.dump({
+                    'energy_threshold': self.recognizer.energy_threshold,
+                    'dynamic_energy_threshold': self.recognizer.dynamic_energy_threshold,
+                    'device_index': self.microphone.device_index,
+                    'version': CALIBRATION_VERSION
+                }, file)
+        except OSError as e:
+            self.logger.warning(f"Could not save microphone calibration: {e}")
+    
+    def load_acknowledgment_sound(self):
+        """Decode the acknowledgment audio file (or build the fallback tone) ready for playback"""
         tone_config = self.config['acknowledgment_tone']
+        if not tone_config['enabled'] or not AUDIO_PLAYBACK_AVAILABLE:
+            return None, None
         
-        # Support both old 'wav_file' and new 'audio_file' config keys for backward compatibility
-        audio_file = tone_config.get('audio_file') or tone_config.get('wav_file', 'acknowledgment.wav')
         volume = tone_config.get('volume', 0.5)
         
-        # Try to play audio file first
+        # Try to load audio file first
         try:
             # Check if file exists
-            if Path(audio_file).exists():
-                self.logger.debug(f"Attempting to play audio file: {audio_file}")
+            if self.ack_exists:
+                # Reuse the PCM rendered on a previous run if the file and volume are unchanged
+                cache_key = f"{self.ack_path.resolve()}|{self.ack_path.stat().st_mtime}|{volume}"
+                cache_stem = 'ack-' + hashlib.sha1(cache_key.encode()).hexdigest()[:16]
+                for cached in CACHE_DIR.glob(f"{cache_stem}-*.npy"):
+                    sample_rate = int(cached.stem.rsplit('-', 1)[1])
+                    self.logger.debug(f"Loaded cached acknowledgment sound: {cached}")
+                    return np.load(cached), sample_rate
                 
-                # Load and play audio file (supports WAV, MP3, FLAC, OGG, etc.)
-                data, sample_rate = sf.read(audio_file)
+                # Load audio file (supports WAV, MP3, FLAC, OGG, etc.)
+                import soundfile as sf
+                data, sample_rate = sf.read(self.ack_path, dtype='float32')
                 
-                # Apply volume adjustment
-                if volume != 1.0:
-                    data = data * volume
+                # Stereo or multi-channel - convert to mono by taking the mean
+                audio_data = np.ascontiguousarray(data)
+                if audio_data.ndim == 2:
+                    audio_data = audio_data.mean(axis=1, dtype=np.float32)
                 
-                # Handle different audio formats
-                if len(data.shape) == 1:
-                    # Mono audio
-                    audio_data = data
-                else:
-                    # Stereo or multi-channel - convert to mono by taking the mean
-                    audio_data = np.mean(data, axis=1) if data.shape[1] > 1 else data.flatten()
+                # Apply volume and keep in range, reusing the same buffer
+                if volume != 1.0:
+                    np.multiply(audio_data, volume, out=audio_data)
+                np.clip(audio_data, -1.0, 1.0, out=audio_data)
                 
-                # Ensure audio data is in the correct range
-                audio_data = np.clip(audio_data, -1.0, 1.0)
+                self.logger.debug(f"Loaded {self.ack_ext} acknowledgment file: {self.ack_path}")
                 
-                # Play the audio
-                sd.play(audio_data, sample_rate)
-                sd.wait()  # Wait for playback to complete
+                try:
+                    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                    np.save(CACHE_DIR / f"{cache_stem}-{sample_rate}.npy", audio_data)
+                except OSError as e:
+                    self.logger.warning(f"Could not cache acknowledgment sound: {e}")
                 
-                file_extension = Path(audio_file).suffix.upper()
-                self.logger.debug(f"Successfully played {file_extension} acknowledgment file: {audio_file}")
-                return
+                return audio_data, sample_rate
                 
             else:
-                self.logger.warning(f"Audio file not found: {audio_file}, using fallback tone")
+                self.logger.warning(f"Audio file not found: {self.ack_path}, using fallback tone")
                 
         except Exception as e:
-            self.logger.warning(f"Failed to play audio file '{audio_file}': {e}, using fallback tone")
+            self.logger.warning(f"Failed to load audio file '{self.ack_path}': {e}, using fallback tone")
+        
+        return self.build_fallback_tone(tone_config.get('fallback_tone', {}), volume)
+    
+    def build_fallback_tone(self, fallback_config, volume):
+        """Generate the sine tone used when the acknowledgment file can't be played"""
+        frequency = fallback_config.get('frequency', 800)
+        duration = fallback_config.get('duration', 0.2)
+        sample_rate = 44100
+        
+        # Generate sine wave tone
+        t = np.linspace(0, duration, int(sample_rate * duration), False)
+        tone = (np.sin(2 * np.pi * frequency * t) * volume).astype(np.float32)
+        
+        # Apply fade in/out to avoid clicks
+        fade_samples = int(0.01 * sample_rate)  # 10ms fade
+        if len(tone) > fade_samples * 2:
+            tone[:fade_samples] *= np.linspace(0, 1, fade_samples)
+            tone[-fade_samples:] *= np.linspace(1, 0, fade_samples)
+        
+        return tone, sample_rate
+    
+    def open_acknowledgment_stream(self):
+        """Open the output stream the acknowledgment sound is played through"""
+        if self.ack_data is None:
+            return None
         
-        # Fallback to generated tone if audio file fails
         try:
-            fallback_config = tone_config.get('fallback_tone', {})
-            frequency = fallback_config.get('frequency', 800)
-            duration = fallback_config.get('duration', 0.2)
-            sample_rate = 44100
-            
-            # Generate sine wave tone
-            t = np.linspace(0, duration, int(sample_rate * duration), False)
-            tone = np.sin(2 * np.pi * frequency * t) * volume
-            
-            # Apply fade in/out to avoid clicks
-            fade_samples = int(0.01 * sample_rate)  # 10ms fade
-            if len(tone) > fade_samples * 2:
-                tone[:fade_samples] *= np.linspace(0, 1, fade_samples)
-                tone[-fade_samples:] *= np.linspace(1, 0, fade_samples)
-            
-            # Play the tone
-            sd.play(tone, sample_rate)
-            sd.wait()  # Wait for playback to complete
+            stream = sd.OutputStream(samplerate=self.ack_rate, channels=1, dtype='float32')
+            stream.start()
+            return stream
+        except Exception as e:
+            self.logger.warning(f"Could not open audio output stream: {e}")
+            return None
+    
+    def play_acknowledgment_tone(self):
+        """
+        Play the preloaded acknowledgment sound to acknowledge wake word detection
+        Returns True if the sound was played
+        """
+        if not self.config['acknowledgment_tone']['enabled']:
+            return False
             
-            self.logger.debug("Played fallback acknowledgment tone")
+        if not AUDIO_PLAYBACK_AVAILABLE:
+            self.logger.warning("Audio playback not available - cannot play acknowledgment")
+            return False
+        
+        try:
+            if self.ack_stream is not None:
+                self.ack_stream.write(self.ack_data)
+            else:
+                sd.play(self.ack_data, self.ack_rate)
+                sd.wait()  # Wait for playback to complete
+            self.logger.debug("Played acknowledgment sound")
+            return True
             
         except Exception as e:
             self.logger.warning(f"Failed to play acknowledgment sound: {e}")
+            return False
     
     def send_to_webhook(self, text):
-        """Send transcribed text to n8n webhook"""
+        """Queue transcribed text for the n8n webhook, posted in the background by webhook_worker"""
         payload = {
             "body": {
                 "content": {
@@ -205,101 +491,308 @@ class VoiceAssistant:
                 }
             }
         }
-        
+        self.loop.call_soon_threadsafe(self.enqueue_webhook, payload)
+    
+    def enqueue_webhook(self, payload):
+        """Add a payload to the webhook queue (runs on the event loop)"""
         try:
-            response = requests.post(
-                self.config['webhook_url'],
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=10
-            )
+            self.webhook_queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.logger.error(f"Webhook queue full, dropping: {payload['body']['content']['text']}")
+    
+    async def webhook_worker(self):
+        """Post queued payloads to the webhook one at a time"""
+        self.webhook_queue = asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+        while True:
+            payload = await self.webhook_queue.get()
+            try:
+                await self.post_webhook(payload)
+            except Exception as e:
+                self.logger.error(f"Webhook worker error: {e}")
+            finally:
+                self.webhook_queue.task_done()
+    
+    async def post_webhook(self, payload):
+        """Send a queued payload to the n8n webhook"""
+        text = payload['body']['content']['text']
+        body = orjson.dumps(payload) if orjson else json.dumps(payload).encode()
+        try:
+            for attempt in range(WEBHOOK_RETRIES + 1):
+                response = await self.http.post(self.config['webhook_url'], content=body)
+                if response.status_code not in WEBHOOK_RETRY_STATUSES or attempt == WEBHOOK_RETRIES:
+                    break
+                await asyncio.sleep(WEBHOOK_BACKOFF * 2 ** attempt)
             
             if response.status_code == 200:
                 self.logger.info(f"Successfully sent to webhook: {text}")
             else:
                 self.logger.error(f"Webhook error {response.status_code}: {response.text}")
                 
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             self.logger.error(f"Failed to send to webhook: {e}")
     
+    async def drain_webhooks(self):
+        """Give queued payloads a chance to be sent, then close the client"""
+        try:
+            await asyncio.wait_for(self.webhook_queue.join(), timeout=10)
+        except asyncio.TimeoutError:
+            self.logger.warning("Unsent webhook commands dropped on shutdown")
+        await self.http.aclose()
+    
+    def match_phrases(self, audio_text):
+        """Return the kinds ('WAKE', 'STOP') of configured phrases found in the text"""
+        text = audio_text.lower()
+        if self.automaton is not None:
+            return {kind for _, kind in self.automaton.iter(text)}
+        # Check every phrase, so one that is a prefix of another is still found
+        return {kind for phrase, kind in self.phrase_kinds.items() if phrase in text}
+    
     def detect_wake_word_simple(self, audio_text):
         """Simple wake word detection using text matching"""
         if not audio_text:
             return False
             
-        wake_word = self.config['wake_word'].lower()
-        text_lower = audio_text.lower()
-        
-        return wake_word in text_lower
+        return 'WAKE' in self.match_phrases(audio_text)
     
     def detect_stop_phrase(self, audio_text):
         """Detect stop phrases in the audio text"""
         if not audio_text:
             return False
             
-        text_lower = audio_text.lower()
-        stop_phrases = [phrase.lower() for phrase in self.config['stop_phrases']]
-        
-        return any(phrase in text_lower for phrase in stop_phrases)
+        return 'STOP' in self.match_phrases(audio_text)
     
     def process_audio_with_noise_reduction(self, audio_data):
-        """Apply noise reduction if pydub is available"""
-        if not PYDUB_AVAILABLE:
+        """Peak-normalize int16 PCM in place so quiet commands reach full scale"""
+        if not AUDIO_PLAYBACK_AVAILABLE or audio_data.size == 0:
             return audio_data
+        
+        # abs() of -32768 overflows int16, so take the peak from max/min
+        peak = max(int(audio_data.max()), -int(audio_data.min()))
+        if 0 < peak < 32767:
+            np.multiply(audio_data, 32767 / peak, out=audio_data, casting='unsafe')
+        return audio_data
+    
+    def on_audio_frame(self, indata, frames, time_info, status):
+        """sounddevice callback - copy each 80 ms frame into the ring buffer"""
+        start = self.ring_pos % len(self.ring)
+        self.ring[start:start + frames] = np.frombuffer(indata, dtype=np.int16)
+        self.ring_pos += frames
+        self.frames.put(self.ring_pos)
+    
+    def start_audio_stream(self):
+        """Start capturing the microphone into the ring buffer, or leave capture to sr.Microphone if that fails"""
+        if AUDIO_PLAYBACK_AVAILABLE and self.stream is None:
+            try:
+                stream = sd.RawInputStream(
+                    samplerate=KWS_SAMPLE_RATE,
+                    blocksize=KWS_FRAME_SAMPLES,
+                    channels=1,
+                    dtype='int16',
+                    callback=self.on_audio_frame
+                )
+                stream.start()
+                self.stream = stream
+            except Exception as e:
+                self.logger.warning(f"Could not open microphone stream, using speech_recognition capture: {e}")
+    
+    def stop_audio_stream(self):
+        """Stop capturing the microphone"""
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+    
+    def ring_samples(self, start, end):
+        """Samples between two ring positions, as a view unless they wrap around"""
+        size = len(self.ring)
+        start = max(start, self.ring_pos - size)
+        offset = start % size
+        if offset + end - start <= size:
+            return self.ring[offset:offset + end - start]
+        return np.concatenate((self.ring[offset:], self.ring[:end - start - (size - offset)]))
+    
+    def adjust_energy_threshold(self, energy):
+        """Track ambient noise on a non-speech frame, like Recognizer.listen with dynamic_energy_threshold"""
+        if self.recognizer.dynamic_energy_threshold:
+            damping = self.recognizer.dynamic_energy_adjustment_damping ** (KWS_FRAME_SAMPLES / KWS_SAMPLE_RATE)
+            target_energy = energy * self.recognizer.dynamic_energy_ratio
+            self.recognizer.energy_threshold = self.recognizer.energy_threshold * damping + target_energy * (1 - damping)
+    
+    def frame_at(self, pos):
+        """The 80 ms frame ending at a ring position, or None if it has been overwritten"""
+        if pos <= self.ring_pos - len(self.ring):
+            return None
+        frame = self.ring_samples(pos - KWS_FRAME_SAMPLES, pos)
+        return frame if len(frame) == KWS_FRAME_SAMPLES else None
+    
+    def listen(self, timeout, phrase_time_limit, start=None):
+        """
+        Capture one phrase from the ring buffer (or the microphone if direct
+        capture isn't running), like Recognizer.listen
+        """
+        if self.stream is None:
+            with self.microphone as source:
+                return self.recognizer.listen(source, timeout=timeout, phrase_time_limit=phrase_time_limit)
+        
+        if start is None:
+            start = self.ring_pos
+        pause_samples = int(self.recognizer.pause_threshold * KWS_SAMPLE_RATE)
+        onset = None
+        silent = 0
+        
+        while True:
+            try:
+                pos = self.frames.get(timeout=1)
+            except queue.Empty:
+                raise sr.WaitTimeoutError("no audio from microphone")
+            if pos <= start:
+                continue
+            
+            # Skip frames the ring has already overwritten while we fell behind
+            frame = self.frame_at(pos)
+            if frame is None:
+                continue
+            
+            energy = frame_rms_zcr(frame)[0]
+            speaking = energy > self.recognizer.energy_threshold
             
+            if onset is None:
+                if speaking:
+                    onset = max(start, pos - KWS_FRAME_SAMPLES - int(PREROLL_SECONDS * KWS_SAMPLE_RATE))
+                    continue
+                self.adjust_energy_threshold(energy)
+                if pos - start >= timeout * KWS_SAMPLE_RATE:
+                    raise sr.WaitTimeoutError("listening timed out while waiting for phrase to start")
+                continue
+            
+            # Phrase ends after pause_threshold of silence or at the time limit
+            silent = 0 if speaking else silent + KWS_FRAME_SAMPLES
+            if silent >= pause_samples or pos - onset >= phrase_time_limit * KWS_SAMPLE_RATE:
+                self.phrase_end = pos
+                return sr.AudioData(self.ring_samples(onset, pos).tobytes(), KWS_SAMPLE_RATE, 2)
+    
+    def voice_gate(self, frame):
+        """Cheap voice activity check deciding whether a frame is worth scoring"""
+        rms, _ = frame_rms_zcr(frame)
+        triggered = False
+        if rms < self.recognizer.energy_threshold:
+            # Too quiet to be speech, no need to ask webrtcvad
+            self.adjust_energy_threshold(rms)
+            self.speech_run = 0
+        elif self.vad is None:
+            triggered = True
+        else:
+            data = frame.tobytes()
+            for start in range(0, len(data), VAD_SUBFRAME_BYTES):
+                if self.vad.is_speech(data[start:start + VAD_SUBFRAME_BYTES], KWS_SAMPLE_RATE):
+                    self.speech_run += 1
+                    triggered = triggered or self.speech_run >= VAD_MIN_SPEECH_SUBFRAMES
+                else:
+                    self.speech_run = 0
+        
+        if triggered:
+            self.gate_hangover = VAD_HANGOVER_FRAMES
+            return True
+        if self.gate_hangover:
+            self.gate_hangover -= 1
+            return True
+        return False
+    
+    def spot_wake_word(self):
+        """Run one audio frame through the local wake word model"""
         try:
-            # Convert audio data to AudioSegment
-            audio_segment = AudioSegment.from_wav(audio_data)
+            pos = self.frames.get(timeout=1)
+        except queue.Empty:
+            return False
+        
+        frame = self.frame_at(pos)
+        if frame is None:
+            return False
+        if not self.voice_gate(frame):
+            self.gated.append(pos)
+            self.gate_closed += 1
+            return False
+        
+        # After a long quiet spell the model's context is stale audio; start it
+        # afresh, then feed the lead-in the gate held back so the start of the
+        # wake word isn't lost
+        if self.gate_closed > VAD_LEAD_IN_FRAMES:
+            self.kws_features.reset()
+        for gated_pos in self.gated:
+            gated_frame = self.frame_at(gated_pos)
+            if gated_frame is not None:
+                self.kws_features(gated_frame)
+        self.gated.clear()
+        self.gate_closed = 0
+        
+        self.kws_features(frame)
+        features = self.kws_features.get_features(self.kws_window)
+        score = self.kws_session.run(None, {self.kws_input.name: features})[0]
+        if score.max() < self.config.get('wake_word_threshold', 0.5):
+            return False
+        
+        self.kws_features.reset()
+        self.wake_end = pos
+        return True
+    
+    def recognize_wake_word(self):
+        """Listen for one phrase and check it for the wake word using cloud recognition"""
+        try:
+            # Listen for audio with timeout
+            audio = self.listen(timeout=1, phrase_time_limit=self.config['phrase_timeout'])
             
-            # Apply noise reduction techniques
-            normalized_audio = normalize(audio_segment)
+            # Recognize speech
+            text = self.recognizer.recognize_google(audio, language='en-US')
+            self.logger.debug(f"Heard: {text}")
             
-            # You can add more sophisticated noise reduction here
-            return normalized_audio
+            # Check for wake word
+            self.wake_end = self.phrase_end
+            return self.detect_wake_word_simple(text)
             
-        except Exception as e:
-            self.logger.warning(f"Noise reduction failed: {e}")
-            return audio_data
+        except sr.WaitTimeoutError:
+            # Timeout occurred, continue listening
+            pass
+        except sr.UnknownValueError:
+            # No speech recognized, continue listening
+            pass
+        except sr.RequestError as e:
+            self.logger.error(f"Recognition error: {e}")
+            time.sleep(1)
+        
+        return False
     
     def listen_for_wake_word(self):
         """Continuously listen for wake word"""
-        self.logger.info(f"Listening for wake word: '{self.config['wake_word']}'")
+        if self.kws_session is not None:
+            self.logger.info(f"Listening for wake word model: '{self.kws_model}'")
+        else:
+            self.logger.info(f"Listening for wake word: '{self.config['wake_word']}'")
         
         while self.listening:
             try:
-                with self.microphone as source:
-                    # Listen for audio with timeout
-                    audio = self.recognizer.listen(
-                        source, 
-                        timeout=1,
-                        phrase_time_limit=self.config['phrase_timeout']
-                    )
+                if self.kws_session is not None and self.stream is not None:
+                    detected = self.spot_wake_word()
+                else:
+                    detected = self.recognize_wake_word()
                 
-                # Recognize speech
-                try:
-                    text = self.recognizer.recognize_google(audio, language='en-US')
-                    self.logger.debug(f"Heard: {text}")
+                # Ignore a repeat trigger straight after the last one
+                if detected and time.monotonic() - self.last_wake >= WAKE_DEBOUNCE:
+                    self.last_wake = time.monotonic()
+                    self.logger.info("Wake word detected!")
+                    self.wake_detected = True
                     
-                    # Check for wake word
-                    if self.detect_wake_word_simple(text):
-                        self.logger.info("Wake word detected!")
-                        self.wake_detected = True
-                        
-                        # Play acknowledgment tone
-                        self.play_acknowledgment_tone()
-                        
-                        self.capture_command()
-                        
-                except sr.UnknownValueError:
-                    # No speech recognized, continue listening
-                    pass
-                except sr.RequestError as e:
-                    self.logger.error(f"Recognition error: {e}")
-                    time.sleep(1)
+                    # Play acknowledgment tone, leaving it out of the command audio
+                    if self.play_acknowledgment_tone():
+                        # ack_stream.write returns once the tone is buffered, so
+                        # its tail is still playing for the output latency
+                        latency = self.ack_stream.latency if self.ack_stream is not None else 0
+                        if self.stream is not None:
+                            self.wake_end = self.ring_pos + int(latency * KWS_SAMPLE_RATE)
+                        else:
+                            time.sleep(latency)
+                    
+                    self.capture_command()
                     
-            except sr.WaitTimeoutError:
-                # Timeout occurred, continue listening
-                pass
             except KeyboardInterrupt:
                 self.logger.info("Interrupted by user")
                 break
@@ -307,25 +800,62 @@ class VoiceAssistant:
                 self.logger.error(f"Error in wake word detection: {e}")
                 time.sleep(1)
     
+    def load_stt_model(self):
+        """Load the Vosk recognizer used for local command transcription"""
+        if not VOSK_AVAILABLE:
+            return None
+        
+        stt_model = self.config.get('stt_model', 'en-us')
+        try:
+            if Path(stt_model).is_dir():
+                model = vosk.Model(stt_model)
+            else:
+                model = vosk.Model(lang=stt_model)
+            recognizer = vosk.KaldiRecognizer(model, KWS_SAMPLE_RATE)
+            recognizer.SetWords(True)
+            self.logger.info(f"Using local speech-to-text model: {stt_model}")
+            return recognizer
+        except Exception as e:
+            self.logger.warning(f"Could not load speech-to-text model '{stt_model}': {e}, using Google")
+            return None
+    
+    def transcribe_locally(self, raw):
+        """Transcribe 16 kHz PCM with Vosk, or return None if it isn't available or confident"""
+        if self.stt is None:
+            return None
+        
+        self.stt.AcceptWaveform(raw)
+        result = json.loads(self.stt.FinalResult())
+        words = result.get('result', [])
+        if not words:
+            return None
+        
+        confidence = sum(word['conf'] for word in words) / len(words)
+        if confidence < self.config.get('stt_min_confidence', 0.6):
+            self.logger.debug(f"Local transcript '{result['text']}' below confidence ({confidence:.2f})")
+            return None
+        return result['text']
+    
+    def transcribe(self, audio):
+        """Transcribe a command locally, falling back to Google"""
+        raw = audio.get_raw_data(convert_rate=KWS_SAMPLE_RATE, convert_width=2)
+        return self.transcribe_locally(raw) or self.recognizer.recognize_google(audio, language='en-US')
+    
     def capture_command(self):
         """Capture and process voice command after wake word"""
         self.logger.info("Listening for command...")
         
         try:
-            with self.microphone as source:
-                # Give user time to speak after wake word
-                time.sleep(0.5)
-                
-                # Listen for command
-                audio = self.recognizer.listen(
-                    source,
-                    timeout=self.config['recognition_timeout'],
-                    phrase_time_limit=10
-                )
+            # Listen for command, starting right where the wake word ended
+            audio = self.listen(
+                timeout=self.config['recognition_timeout'],
+                phrase_time_limit=10,
+                start=self.wake_end
+            )
             
             # Recognize the command
             try:
-                command_text = self.recognizer.recognize_google(audio, language='en-US')
+                command_text = self.transcribe(audio)
                 self.logger.info(f"Command captured: {command_text}")
                 
                 # Check for stop phrase
@@ -334,7 +864,7 @@ class VoiceAssistant:
                     self.stop_listening()
                     return
                 
-                # Send command to webhook
+                # Queue command for the webhook
                 self.send_to_webhook(command_text)
                 
             except sr.UnknownValueError:
@@ -364,6 +894,7 @@ class VoiceAssistant:
         self.logger.info(f"Stop phrases: {self.config['stop_phrases']}")
         self.logger.info("Say 'Ctrl+C' to quit or use stop phrases")
         
+        self.start_audio_stream()
         try:
             self.listen_for_wake_word()
         except KeyboardInterrupt:
@@ -373,7 +904,22 @@ class VoiceAssistant:
     
     def stop_listening(self):
         """Stop the voice assistant"""
+        # A stop phrase stops from capture_command, then start_listening's finally calls again
+        if self.stopped:
+            return
+        self.stopped = True
         self.listening = False
+        self.stop_audio_stream()
+        if self.ack_stream is not None:
+            self.ack_stream.close()
+            self.ack_stream = None
+        
+        # Flush the webhook queue, close the client and stop its event loop
+        if self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.drain_webhooks(), self.loop).result(timeout=15)
+            self.webhook_task.cancel()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        
         self.logger.info("Voice Assistant stopped")
 
 